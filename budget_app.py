@@ -1,11 +1,15 @@
 # budget_app.py
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 import gspread
 import uuid
+import re
+import time
+import random
+import functools
 from datetime import datetime
-from gspread.exceptions import WorksheetNotFound
+from gspread.exceptions import APIError, WorksheetNotFound
 from google.oauth2.service_account import Credentials
 import json
 
@@ -16,7 +20,38 @@ if isinstance(sa_info, str):
 
 SHEET_ID = st.secrets["SHEET_ID"]
 
+RETRY_STATUSES = (429, 500, 503)
+# a 500/503 may arrive after a write was applied; only a 429 is known to be rejected
+WRITE_RETRY_STATUSES = (429,)
+MAX_ATTEMPTS = 5
+DATE_FMT = "%Y-%m-%d %H:%M:%S"
+CAT_HEADERS = ("id", "category", "budget", "type")
+EXP_HEADERS = ("id", "category", "amount", "note", "date")
+SUMMARY_COLUMNS = ["Category", "Type", "Budget", "Spent", "Remaining"]
+CACHE_MAX_ENTRIES = 128
+FLUSH_BATCH_SIZE = 10
+FLUSH_INTERVAL_SECS = 5
+FLUSH_TICK_SECS = 1
+
 # ------------------ helpers for Google Sheets ------------------
+def retry_api(fn, retry_on=RETRY_STATUSES):
+    """Retry a Sheets call with exponential backoff on rate limits / transient errors."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return fn(*args, **kwargs)
+            except APIError as e:
+                if e.response.status_code not in retry_on or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(2 ** attempt + random.random())
+    return wrapper
+
+def retry_write(fn):
+    """retry_api for calls that are not safe to repeat (appends, row deletes...)."""
+    return retry_api(fn, retry_on=WRITE_RETRY_STATUSES)
+
+@st.cache_resource
 def connect_sheet():
     creds = Credentials.from_service_account_info(
         sa_info,
@@ -26,119 +61,343 @@ def connect_sheet():
         ]
     )
     gc = gspread.authorize(creds)
-    sh = gc.open_by_key(SHEET_ID)
+    sh = retry_api(gc.open_by_key)(SHEET_ID)
     return sh
 
 def ensure_ws(sh, title, headers):
     """Return worksheet; create with headers if not exist."""
     try:
-        ws = sh.worksheet(title)
+        ws = retry_api(sh.worksheet)(title)
     except WorksheetNotFound:
-        ws = sh.add_worksheet(title=title, rows="100", cols="20")
-        ws.append_row(headers)
+        ws = retry_write(sh.add_worksheet)(title=title, rows="100", cols="20")
+        retry_write(ws.append_row)(headers)
         return ws
     # ensure header row exists & matches
-    row1 = ws.row_values(1)
+    row1 = retry_api(ws.row_values)(1)
     if row1 != headers:
         try:
-            ws.delete_rows(1)
+            retry_write(ws.delete_rows)(1)
         except Exception:
             pass
-        ws.insert_row(headers, index=1)
+        retry_write(ws.insert_row)(headers, index=1)
     return ws
 
-def load_data_from_sheets(cat_ws, exp_ws):
+@st.cache_resource(ttl=3600)
+def ensure_ws_cached(sheet_id, title, headers_tuple):
+    """Worksheet handle; the header check only runs when the cache is cold."""
+    sh = connect_sheet()
+    return ensure_ws(sh, title, list(headers_tuple))
+
+def get_worksheets():
+    """Return (categories, expenses) worksheets."""
+    cat_ws = ensure_ws_cached(SHEET_ID, "categories", CAT_HEADERS)
+    exp_ws = ensure_ws_cached(SHEET_ID, "expenses", EXP_HEADERS)
+    return cat_ws, exp_ws
+
+def _value_range_columns(value_range):
+    """Turn one values.batchGet range into {header: column list}."""
+    values = value_range.get("values", [])
+    if not values:
+        return {}
+    header = [str(h) for h in values[0]]
+    width = len(header)
+    rows = [r + [""] * (width - len(r)) for r in values[1:]]
+    return {h: [r[i] for r in rows] for i, h in enumerate(header)}
+
+def _to_int_column(values):
+    """Parse a whole column to ints in one pass; blanks, junk, inf and out-of-range values become 0."""
+    nums = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").astype(np.float64)
+    nums = nums.where(np.isfinite(nums) & (nums.abs() < 2.0 ** 63), 0)
+    return nums.astype(np.int64).tolist()
+
+def load_data_from_sheets(sh):
+    # one values.batchGet round trip for both worksheets; errors propagate so
+    # that _load_data never caches an empty snapshot
+    result = retry_api(sh.values_batch_get)(["categories!A:D", "expenses!A:E"])
+    cat_range, exp_range = result.get("valueRanges", [{}, {}])
+
     cats = {}
-    try:
-        cat_records = cat_ws.get_all_records()
-    except Exception:
-        cat_records = []
-    for r in cat_records:
-        name = r.get("category", "").strip()
+    cat_cols = _value_range_columns(cat_range)
+    cat_names = cat_cols.get("category", [])
+    cat_ids = cat_cols.get("id", [""] * len(cat_names))
+    cat_budgets = _to_int_column(cat_cols.get("budget", [0] * len(cat_names)))
+    cat_types = cat_cols.get("type", [""] * len(cat_names))
+    for name, cid, budget, btype in zip(cat_names, cat_ids, cat_budgets, cat_types):
+        name = str(name).strip()
         if name == "":
             continue
-        cid = r.get("id") or uuid.uuid4().hex
-        budget = int(float(r.get("budget", 0) or 0))
-        btype = r.get("type") or "Monthly"
-        cats[name] = {"id": cid, "budget": budget, "type": btype, "expenses": []}
+        cats[name] = {
+            "id": str(cid) or uuid.uuid4().hex,
+            "budget": budget,
+            "type": btype or "Monthly",
+            "expenses": [],
+        }
 
-    try:
-        exp_records = exp_ws.get_all_records()
-    except Exception:
-        exp_records = []
-    for r in exp_records:
-        cat = r.get("category", "").strip()
+    exp_cols = _value_range_columns(exp_range)
+    exp_cats = exp_cols.get("category", [])
+    exp_ids = exp_cols.get("id", [""] * len(exp_cats))
+    exp_amounts = _to_int_column(exp_cols.get("amount", [0] * len(exp_cats)))
+    exp_notes = exp_cols.get("note", [""] * len(exp_cats))
+    exp_dates = exp_cols.get("date", [""] * len(exp_cats))
+    # sheet row of every expense id (row 1 is the header)
+    exp_row_by_id = {str(eid): i for i, eid in enumerate(exp_ids, start=2) if eid}
+    for cat, eid, amount, note, date in zip(exp_cats, exp_ids, exp_amounts, exp_notes, exp_dates):
+        cat = str(cat).strip()
         if cat == "":
             continue
-        eid = r.get("id") or uuid.uuid4().hex
-        try:
-            amount = int(float(r.get("amount", 0) or 0))
-        except:
-            amount = 0
-        note = r.get("note") or ""
-        date = r.get("date") or ""
         if cat not in cats:
             cats[cat] = {"id": uuid.uuid4().hex, "budget": 0, "type": "Monthly", "expenses": []}
-        cats[cat]["expenses"].append({"id": eid, "amount": amount, "note": note, "date": date})
-    return cats
+        cats[cat]["expenses"].append({
+            "id": str(eid) or uuid.uuid4().hex,
+            "amount": amount,
+            "note": str(note),
+            "date": str(date),
+        })
+    return cats, exp_row_by_id
+
+@st.cache_data(ttl=60)
+def _load_data(sheet_id: str, rev: int) -> tuple:
+    """Cached sheet read; bump `rev` or call `_load_data.clear()` to force a refetch."""
+    get_worksheets()  # make sure both worksheets exist before reading them
+    return load_data_from_sheets(connect_sheet())
 
 def append_category(cat_ws, name, budget, btype):
     cid = uuid.uuid4().hex
-    cat_ws.append_row([cid, name, budget, btype])
+    retry_write(cat_ws.append_row)([cid, name, budget, btype])
+    _load_data.clear()
     return cid
 
-def append_expense(exp_ws, category, amount, note, date):
+def queue_expense(category, amount, note, date):
+    """Buffer an expense row; it reaches the sheet on the next flush."""
     eid = uuid.uuid4().hex
-    exp_ws.append_row([eid, category, amount, note, date])
+    if not st.session_state.pending_exp:
+        st.session_state.pending_since = time.time()
+    st.session_state.pending_exp.append([eid, category, amount, note, date])
+    return eid
+
+def flush_pending_expenses(exp_ws):
+    """Write every buffered expense with a single append_rows call.
+
+    Returns False (keeping the rows buffered) if the write fails.
+    """
+    pending = st.session_state.pending_exp
+    if not pending:
+        return True
+    try:
+        resp = retry_write(exp_ws.append_rows)(pending)
+    except Exception as e:
+        st.warning(f"Could not save {len(pending)} expense(s) to the sheet ({e}); they are kept and will be retried.")
+        return False
+    # e.g. "expenses!A7:E9" -> rows 7..9
+    m = re.search(r"![A-Z]+(\d+)", resp.get("updates", {}).get("updatedRange", ""))
+    if m:
+        start = int(m.group(1))
+        for offset, row in enumerate(pending):
+            st.session_state.exp_row_by_id[row[0]] = start + offset
+    pending.clear()
+    _load_data.clear()
+    return True
+
+def maybe_flush_pending_expenses(exp_ws):
+    """Flush once the buffer is full or its oldest expense has waited too long."""
+    pending = st.session_state.pending_exp
+    if len(pending) >= FLUSH_BATCH_SIZE or (pending and time.time() - st.session_state.pending_since >= FLUSH_INTERVAL_SECS):
+        flush_pending_expenses(exp_ws)
+
+def log_expense(exp_ws, category, amount, note, date):
+    """Queue an expense; it is written at once unless it is part of a rapid burst of adds."""
+    rapid = time.time() - st.session_state.last_add < FLUSH_INTERVAL_SECS
+    st.session_state.last_add = time.time()
+    eid = queue_expense(category, amount, note, date)
+    if rapid:
+        maybe_flush_pending_expenses(exp_ws)
+    else:
+        flush_pending_expenses(exp_ws)
     return eid
 
-def delete_category_and_its_expenses(cat_ws, exp_ws, category_name):
+@st.fragment(run_every=FLUSH_TICK_SECS)
+def pending_expenses_status(exp_ws):
+    """Flush buffered expenses on a timer and show what is still unsaved."""
+    maybe_flush_pending_expenses(exp_ws)
+    pending = st.session_state.pending_exp
+    if pending:
+        st.info(f"Saving {len(pending)} expense(s) to the sheet…")
+        if st.button("💾 Save now", key="flush_exp_btn") and flush_pending_expenses(exp_ws):
+            st.rerun(scope="fragment")
+
+def delete_rows_batch(ws, rows):
+    """Delete the given 1-based rows in a single batchUpdate call."""
+    if not rows:
+        return
+    requests = [
+        {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": r - 1, "endIndex": r}}}
+        for r in sorted(rows, reverse=True)
+    ]
+    retry_write(ws.spreadsheet.batch_update)({"requests": requests})
+
+def _reindex_expense_rows(row_by_id, ids):
+    """Rebuild the id -> row index from the sheet's id column."""
+    row_by_id.clear()
+    row_by_id.update({eid: i for i, eid in enumerate(ids, start=1) if i > 1 and eid})
+
+def _find_expense_row(exp_ws, row_by_id, exp_id):
+    """Row of `exp_id`, checked against the sheet with a one-cell read."""
+    row = row_by_id.get(exp_id)
+    if row is not None and retry_api(exp_ws.acell)(f"A{row}").value == exp_id:
+        return row
+    # index is stale (sheet edited elsewhere): fall back to the id column
+    _reindex_expense_rows(row_by_id, retry_api(exp_ws.col_values)(1))
+    return row_by_id.get(exp_id)
+
+def _drop_expense_rows(row_by_id, rows):
+    """Forget deleted rows and shift every row below them up."""
+    removed = np.sort(np.asarray(rows, dtype=np.int64))
+    gone = set(removed.tolist())
+    for eid in [eid for eid, r in row_by_id.items() if r in gone]:
+        del row_by_id[eid]
+    if removed.size and row_by_id:
+        ids = list(row_by_id)
+        old = np.fromiter(row_by_id.values(), dtype=np.int64, count=len(ids))
+        new = old - np.searchsorted(removed, old)
+        row_by_id.update(zip(ids, new.tolist()))
+
+def delete_category_and_its_expenses(cat_ws, exp_ws, row_by_id, category_name):
     # delete category rows
-    vals = cat_ws.get_all_values()
-    rows_to_delete = []
-    for i, row in enumerate(vals[1:], start=2):
-        if len(row) >= 2 and row[1] == category_name:
-            rows_to_delete.append(i)
-    for r in reversed(rows_to_delete):
-        cat_ws.delete_rows(r)
-    # delete expenses rows matching category
-    exp_vals = exp_ws.get_all_values()
-    rows_to_delete = []
-    for i, row in enumerate(exp_vals[1:], start=2):
-        if len(row) >= 2 and row[1] == category_name:
-            rows_to_delete.append(i)
-    for r in reversed(rows_to_delete):
-        exp_ws.delete_rows(r)
-
-def delete_expense_by_id(exp_ws, exp_id):
-    vals = exp_ws.get_all_values()
-    for i, row in enumerate(vals[1:], start=2):
-        if len(row) >= 1 and row[0] == exp_id:
-            exp_ws.delete_rows(i)
-            return True
-    return False
-
-def update_expense_amount(exp_ws, exp_id, new_amount, new_note=None):
-    vals = exp_ws.get_all_values()
-    for i, row in enumerate(vals[1:], start=2):
-        if len(row) >= 1 and row[0] == exp_id:
-            exp_ws.update_cell(i, 3, new_amount)
-            if new_note is not None:
-                exp_ws.update_cell(i, 4, new_note)
-            return True
-    return False
+    names = retry_api(cat_ws.col_values)(2)
+    rows_to_delete = [i for i, name in enumerate(names, start=1) if i > 1 and name == category_name]
+    delete_rows_batch(cat_ws, rows_to_delete)
+    # delete expenses rows matching category (id + category columns only)
+    exp_vals = retry_api(exp_ws.get)("A:B")
+    _reindex_expense_rows(row_by_id, [row[0] if row else "" for row in exp_vals])
+    rows_to_delete = [i for i, row in enumerate(exp_vals, start=1) if i > 1 and len(row) >= 2 and row[1] == category_name]
+    delete_rows_batch(exp_ws, rows_to_delete)
+    _drop_expense_rows(row_by_id, rows_to_delete)
+    _load_data.clear()
+
+def delete_expense_by_id(exp_ws, row_by_id, exp_id):
+    row = _find_expense_row(exp_ws, row_by_id, exp_id)
+    if row is None:
+        return False
+    delete_rows_batch(exp_ws, [row])
+    _drop_expense_rows(row_by_id, [row])
+    _load_data.clear()
+    return True
+
+def update_expense_amount(exp_ws, row_by_id, exp_id, new_amount, new_note=None):
+    row = _find_expense_row(exp_ws, row_by_id, exp_id)
+    if row is None:
+        return False
+    updates = [{"range": f"C{row}", "values": [[new_amount]]}]
+    if new_note is not None:
+        updates.append({"range": f"D{row}", "values": [[new_note]]})
+    retry_write(exp_ws.batch_update)(updates)
+    _load_data.clear()
+    return True
+
+def build_expense_columns(categories):
+    """Flatten all expenses into column lists (one list per field)."""
+    cols = {"Category": [], "Amount": [], "Note": [], "Date": [], "ID": []}
+    for cat, data in categories.items():
+        exps = data.get("expenses", [])
+        cols["Category"].extend([cat] * len(exps))
+        cols["Amount"].extend(e.get("amount", 0) for e in exps)
+        cols["Note"].extend(e.get("note", "") for e in exps)
+        cols["Date"].extend(e.get("date", "") for e in exps)
+        cols["ID"].extend(e.get("id") for e in exps)
+    return cols
+
+def _parse_dates(dates):
+    """datetime64[s] sort keys; app-written dates use DATE_FMT, hand-typed ones fall back to mixed parsing."""
+    dates = pd.Series(dates, dtype=object)
+    parsed = pd.to_datetime(dates, format=DATE_FMT, errors="coerce")
+    retry = parsed.isna() & (dates.astype(str).str.strip() != "")
+    if retry.any():
+        parsed[retry] = pd.to_datetime(dates[retry], format="mixed", errors="coerce")
+    return parsed.values.astype("datetime64[s]")
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def build_frames(session_id: str, cats_rev: int, _categories: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Return (summary, history) frames; only (session_id, cats_rev) is hashed."""
+    cat_keys = list(_categories.keys())
+    exp_cols = build_expense_columns(_categories)
+    hist_df = pd.DataFrame({
+        # categorical: groupby/sort work on integer codes instead of hashing strings
+        "Category": pd.Categorical(exp_cols["Category"], dtype=pd.CategoricalDtype(categories=cat_keys, ordered=False)),
+        "Amount": np.asarray(exp_cols["Amount"], dtype=np.int64),
+        "Note": exp_cols["Note"],
+        "Date": exp_cols["Date"],
+        # parsed once per revision; only used for sorting, the raw text is what gets shown
+        "DateKey": _parse_dates(exp_cols["Date"]),
+        "ID": exp_cols["ID"],
+    })
+    spent_series = hist_df.groupby("Category", observed=True, sort=False)["Amount"].sum()
+
+    cat_data = _categories.values()
+    df = pd.DataFrame({
+        "Category": cat_keys,
+        "Type": [d.get("type", "N/A") for d in cat_data],
+        "Budget": np.fromiter((d.get("budget", 0) for d in cat_data), dtype=np.int64, count=len(cat_keys)),
+        "Spent": spent_series.reindex(cat_keys, fill_value=0).values,
+    })
+    df["Remaining"] = df["Budget"] - df["Spent"]
+    return df, hist_df
+
+def style_remaining(col):
+    """Highlight overspent categories (whole column at once)."""
+    return np.where(col.values < 0, 'color: red; font-weight: bold;', '')
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def render_summary_html(session_id: str, cats_rev: int, _df: pd.DataFrame) -> str:
+    """Styled summary table as HTML; the Styler only runs when categories change."""
+    # category names come from a shared sheet: escape them, the HTML goes through st.markdown
+    return _df[SUMMARY_COLUMNS].style.format(escape="html").apply(style_remaining, subset=["Remaining"]).to_html()
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES)
+def make_spent_pie(session_id: str, cats_rev: int, _df: pd.DataFrame):
+    """Donut chart of spending per category; rebuilt only when categories change."""
+    import plotly.graph_objects as go  # imported lazily: only needed once there is spending
+    fig = go.Figure(go.Pie(labels=_df["Category"].tolist(), values=_df["Spent"].tolist(), hole=0.4))
+    fig.update_layout(title="Expense Breakdown")
+    return fig
+
+def reload_from_sheets():
+    """Re-read both worksheets into session state (sheet is the source of truth)."""
+    _load_data.clear()  # the cache is shared by all sessions; never serve another session's snapshot
+    st.session_state.sheet_rev = st.session_state.get("sheet_rev", 0) + 1
+    st.session_state.categories, st.session_state.exp_row_by_id = _load_data(SHEET_ID, st.session_state.sheet_rev)
+    st.session_state.cats_rev += 1
 
 # ------------------ App starts here ------------------
 st.set_page_config(page_title="Budget & Expense Planner", layout="wide")
-sh = connect_sheet()
-cat_ws = ensure_ws(sh, "categories", ["id", "category", "budget", "type"])
-exp_ws = ensure_ws(sh, "expenses", ["id", "category", "amount", "note", "date"])
+cat_ws, exp_ws = get_worksheets()
 
 # load into session state
+if "sheet_rev" not in st.session_state:
+    st.session_state.sheet_rev = 0
+# cats_rev is bumped on every local change to categories/expenses and, together
+# with session_id (cache_data is shared by all sessions), keys the render caches
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.cats_rev = 0
 if "categories" not in st.session_state:
-    st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
+    try:
+        st.session_state.categories, st.session_state.exp_row_by_id = _load_data(SHEET_ID, st.session_state.sheet_rev)
+    except Exception as e:
+        st.error(f"Could not load data from Google Sheets: {e}. Reload the page to try again.")
+        st.stop()
+    st.session_state.cats_rev += 1
+if "pending_exp" not in st.session_state:
+    st.session_state.pending_exp = []
+    st.session_state.last_add = 0.0
+maybe_flush_pending_expenses(exp_ws)
+
+# category names shared by every selectbox; rebuilt only when categories change
+cat_keys = tuple(st.session_state.categories.keys())
 
 st.title("📊 Budget & Expense Planner (Google Sheets)")
+# filled in at the end of the run, once this run's expenses are queued;
+# the fragment inside it re-runs every FLUSH_TICK_SECS to flush on a timer
+pending_box = st.container()
 
 # --- Add category ---
 with st.expander("➕ Add Category", expanded=False):
@@ -147,24 +406,26 @@ with st.expander("➕ Add Category", expanded=False):
     budget_type = st.selectbox("Type", ["Monthly", "Weekly", "Yearly", "One-time"], key="new_type")
     if st.button("Add Category", key="add_cat_btn"):
         if new_cat and new_cat not in st.session_state.categories:
-            append_category(cat_ws, new_cat, int(new_budget), budget_type)
-            st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
+            cid = append_category(cat_ws, new_cat, int(new_budget), budget_type)
+            st.session_state.categories[new_cat] = {"id": cid, "budget": int(new_budget), "type": budget_type, "expenses": []}
+            st.session_state.cats_rev += 1
+            cat_keys = tuple(st.session_state.categories.keys())
             st.success(f"Category '{new_cat}' added.")
         else:
             st.warning("Invalid or duplicate category name.")
 
 # --- Log expenses ---
 with st.expander("💸 Log Expense", expanded=True):
-    if st.session_state.categories:
-        cat_list = list(st.session_state.categories.keys())
-        cat_choice = st.selectbox("Category", cat_list, key="log_cat")
+    if cat_keys:
+        cat_choice = st.selectbox("Category", cat_keys, key="log_cat")
         amt = st.number_input("Amount", min_value=0, step=100, key="log_amount")
         note = st.text_input("Note (optional)", key="log_note")
         if st.button("Add Expense", key="add_exp_btn"):
             if amt > 0:
-                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                append_expense(exp_ws, cat_choice, int(amt), note, now)
-                st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
+                now = datetime.now().strftime(DATE_FMT)
+                eid = log_expense(exp_ws, cat_choice, int(amt), note, now)
+                st.session_state.categories[cat_choice]["expenses"].append({"id": eid, "amount": int(amt), "note": note, "date": now})
+                st.session_state.cats_rev += 1
                 st.success(f"Added {amt} to {cat_choice}")
             else:
                 st.warning("Enter an amount greater than 0.")
@@ -173,58 +434,51 @@ with st.expander("💸 Log Expense", expanded=True):
 
 # --- Manage categories (delete) ---
 with st.expander("🗂️ Manage Categories", expanded=False):
-    if st.session_state.categories:
-        to_delete = st.selectbox("Select category to delete", list(st.session_state.categories.keys()), key="del_cat")
-        if st.button("Delete Category", key="del_cat_btn"):
-            delete_category_and_its_expenses(cat_ws, exp_ws, to_delete)
-            st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
+    if cat_keys:
+        to_delete = st.selectbox("Select category to delete", cat_keys, key="del_cat")
+        if st.button("Delete Category", key="del_cat_btn") and flush_pending_expenses(exp_ws):
+            delete_category_and_its_expenses(cat_ws, exp_ws, st.session_state.exp_row_by_id, to_delete)
+            del st.session_state.categories[to_delete]
+            st.session_state.cats_rev += 1
+            cat_keys = tuple(st.session_state.categories.keys())
             st.success(f"Deleted category '{to_delete}' and its expenses.")
     else:
         st.info("No categories yet.")
 
 # --- Summary & History ---
+# widget-only reruns keep the same cats_rev and reuse the cached frames
+cache_key = (st.session_state.session_id, st.session_state.cats_rev)
+df, hist_df = build_frames(*cache_key, st.session_state.categories)
+
 st.header("📊 Summary")
-summary = []
-for cat, data in st.session_state.categories.items():
-    budget = data.get("budget", 0)
-    spent = sum(e.get("amount", 0) for e in data.get("expenses", []))
-    summary.append([cat, data.get("type", "N/A"), budget, spent, budget - spent])
-
-if summary:
-    df = pd.DataFrame(summary, columns=["Category", "Type", "Budget", "Spent", "Remaining"])
-    def highlight_over(val):
-        return 'color: red; font-weight: bold;' if val < 0 else ''
-    st.dataframe(df.style.applymap(highlight_over, subset=["Remaining"]))
+if cat_keys:
+    st.markdown(render_summary_html(*cache_key, df), unsafe_allow_html=True)
     total_budget = df["Budget"].sum()
     total_spent = df["Spent"].sum()
     total_remaining = total_budget - total_spent
     st.markdown(f"**Total Budget:** {total_budget}   &nbsp;&nbsp; **Total Spent:** {total_spent}   &nbsp;&nbsp; **Remaining:** {total_remaining}")
 
     st.subheader("Category Progress")
-    for _, row in df.iterrows():
-        progress = row["Spent"] / row["Budget"] if row["Budget"] > 0 else 0
-        st.write(f"**{row['Category']} ({row['Type']})**")
-        st.progress(min(progress, 1.0))
+    budgets = df["Budget"].values
+    progress = np.where(budgets > 0, np.minimum(df["Spent"].values / np.maximum(budgets, 1), 1.0), 0.0)
+    for cat, typ, p in zip(df["Category"].values, df["Type"].values, progress):
+        st.write(f"**{cat} ({typ})**")
+        st.progress(float(p))
 
 else:
     st.info("No categories/expenses yet.")
 
 # Expense history
 st.header("📜 Expense History")
-history = []
-for cat, data in st.session_state.categories.items():
-    for exp in data.get("expenses", []):
-        history.append([cat, exp.get("amount", 0), exp.get("note", ""), exp.get("date", ""), exp.get("id")])
-if history:
-    hist_df = pd.DataFrame(history, columns=["Category", "Amount", "Note", "Date", "ID"])
-    st.dataframe(hist_df.sort_values("Date", ascending=False).drop(columns=["ID"]))
+if not hist_df.empty:
+    st.dataframe(hist_df.sort_values("DateKey", ascending=False).drop(columns=["DateKey", "ID"]))
 else:
     st.info("No expenses logged yet.")
 
 # Manage individual expenses
 with st.expander("✏️ Edit / Delete an Expense", expanded=False):
-    if history:
-        manage_cat = st.selectbox("Choose category", list(st.session_state.categories.keys()), key="man_cat")
+    if not hist_df.empty:
+        manage_cat = st.selectbox("Choose category", cat_keys, key="man_cat")
         exps = st.session_state.categories[manage_cat]["expenses"]
         if exps:
             exp_options = [f"{i+1}. {e['amount']} ({e.get('note','')}) on {e['date']}" for i, e in enumerate(exps)]
@@ -233,17 +487,24 @@ with st.expander("✏️ Edit / Delete an Expense", expanded=False):
             sel_exp = exps[idx]
             col1, col2 = st.columns(2)
             with col1:
-                if st.button("Delete selected expense", key="del_exp_btn"):
-                    delete_expense_by_id(exp_ws, sel_exp["id"])
-                    st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
-                    st.success("Expense deleted.")
+                if st.button("Delete selected expense", key="del_exp_btn") and flush_pending_expenses(exp_ws):
+                    if delete_expense_by_id(exp_ws, st.session_state.exp_row_by_id, sel_exp["id"]):
+                        exps.pop(idx)
+                        st.session_state.cats_rev += 1
+                        st.success("Expense deleted.")
+                    else:
+                        st.error("Expense not found in the sheet; try refreshing from the sheet.")
             with col2:
                 new_amt = st.number_input("Edit amount", min_value=0, step=100, value=sel_exp["amount"], key="edit_amount")
                 new_note = st.text_input("Edit note", value=sel_exp.get("note",""), key="edit_note")
-                if st.button("Save edit", key="save_edit_btn"):
-                    update_expense_amount(exp_ws, sel_exp["id"], int(new_amt), new_note)
-                    st.session_state.categories = load_data_from_sheets(cat_ws, exp_ws)
-                    st.success("Expense updated.")
+                if st.button("Save edit", key="save_edit_btn") and flush_pending_expenses(exp_ws):
+                    if update_expense_amount(exp_ws, st.session_state.exp_row_by_id, sel_exp["id"], int(new_amt), new_note):
+                        sel_exp["amount"] = int(new_amt)
+                        sel_exp["note"] = new_note
+                        st.session_state.cats_rev += 1
+                        st.success("Expense updated.")
+                    else:
+                        st.error("Expense not found in the sheet; try refreshing from the sheet.")
         else:
             st.info("No expenses in this category yet.")
     else:
@@ -251,24 +512,34 @@ with st.expander("✏️ Edit / Delete an Expense", expanded=False):
 
 # Charts
 st.header("📈 Visuals")
-if summary:
-    fig, ax = plt.subplots()
-    x = range(len(df))
-    ax.bar([i-0.2 for i in x], df["Budget"], width=0.4, label="Budget")
-    ax.bar([i+0.2 for i in x], df["Spent"], width=0.4, label="Spent")
-    ax.set_xticks(list(x))
-    ax.set_xticklabels(df["Category"], rotation=45)
-    ax.legend()
-    st.pyplot(fig)
+if cat_keys:
+    st.bar_chart(df.set_index("Category")[["Budget", "Spent"]], stack=False)
 
     if total_spent > 0:
-        fig2, ax2 = plt.subplots()
-        ax2.pie(df["Spent"], labels=df["Category"], autopct='%1.1f%%', startangle=90, wedgeprops={'width':0.4})
-        ax2.set_title("Expense Breakdown")
-        st.pyplot(fig2)
+        st.plotly_chart(make_spent_pie(*cache_key, df))
+
+# Re-read everything from the sheet (e.g. after editing it by hand)
+if st.button("🔄 Refresh from sheet") and flush_pending_expenses(exp_ws):
+    try:
+        reload_from_sheets()
+    except Exception as e:
+        st.error(f"Could not reload from Google Sheets: {e}")
+    else:
+        st.rerun()
+
+# Drop the cached Sheets connection and authorize again
+if st.button("🔌 Reconnect to Google Sheets"):
+    connect_sheet.clear()
+    ensure_ws_cached.clear()
+    st.rerun()
 
 # Reset local session cache (does NOT delete sheet data)
-if st.button("🧹 Clear local session cache"):
+if st.button("🧹 Clear local session cache") and flush_pending_expenses(exp_ws):
     if "categories" in st.session_state:
         del st.session_state["categories"]
-    st.experimental_rerun()
+    _load_data.clear()
+    st.rerun()
+
+# Timed flush + unsaved expenses banner (shown under the title, outside any expander)
+with pending_box:
+    pending_expenses_status(exp_ws)